@@ -1,77 +1,286 @@
 import os
 import asyncio
-from datetime import datetime
+import secrets
+import time
+from array import array
 import aiohttp
+import msgspec
+import orjson
 from aiohttp import web
 import aiosqlite  # Use aiosqlite for asynchronous SQLite operations
 from dotenv import load_dotenv
 import ssl
 
+try:
+    import picologging as logging  # C-реализация с тем же API, что и stdlib logging
+except ImportError:
+    import logging
+
+logger = logging.getLogger('notificator')
+
 load_dotenv()
 
 API_KEY = os.getenv('API-KEY')
+_API_KEY_B = API_KEY.encode() if API_KEY else b''
 bot_token = os.getenv('TELEGRAM_API')
 chat_id = os.getenv('ChAT_ID')
 
+_TG_URL = f'https://api.telegram.org/bot{bot_token}/sendMessage'
+_TG_TIMEOUT = aiohttp.ClientTimeout(total=30)
+
+# Неизменная строка SQL, чтобы попадать в кэш подготовленных выражений sqlite3
+_INSERT_SQL = 'INSERT INTO notifications (service, event, error, message) VALUES (?, ?, ?, ?)'
+
+RATE_LIMIT_REQUESTS = 10  # запросов с одного IP
+RATE_LIMIT_WINDOW = 60  # за окно в секундах
+
+# За прокси все соединения приходят с его адреса, поэтому там IP клиента
+# берется из заголовков; доверять им можно только в этом режиме
+BEHIND_PROXY = bool(os.getenv('BEHIND_PROXY'))
+
 app = web.Application()
 
-async def send_to_telegram(message):
+class Notification(msgspec.Struct):
+    """ Схема уведомления: разбор JSON и проверка типов за один проход на C """
+    service: str
+    message: str
+    event: str = ''
+    error: bool = False
+
+_NOTIF_DECODER = msgspec.json.Decoder(Notification)
+
+def json_response(obj, status=200):
+    """ Ответ в JSON через orjson вместо stdlib-сериализации """
+    return web.Response(body=orjson.dumps(obj), status=status, content_type='application/json')
+
+def client_ip(request):
+    """ IP клиента: за прокси — первый адрес из X-Forwarded-For или X-Real-IP """
+    if BEHIND_PROXY:
+        forwarded = request.headers.get('X-Forwarded-For')
+        if forwarded:
+            return forwarded.split(',', 1)[0].strip()
+        return request.headers.get('X-Real-IP', request.remote)
+    return request.remote
+
+# На каждый IP: кольцо посекундных счетчиков + номер последней активной секунды
+rate_limit_store = {}
+
+def check_rate_limit(ip):
+    """ Скользящее окно на кольце счетчиков: O(1) на запрос, фиксированная память на IP """
+    slot = int(time.monotonic())
+    entry = rate_limit_store.get(ip)
+    if entry is None:
+        entry = [array('I', [0] * RATE_LIMIT_WINDOW), slot]
+        rate_limit_store[ip] = entry
+    buckets, last_slot = entry
+    if slot != last_slot:
+        # Обнуляем секунды, прошедшие с последнего запроса
+        if slot - last_slot >= RATE_LIMIT_WINDOW:
+            for i in range(RATE_LIMIT_WINDOW):
+                buckets[i] = 0
+        else:
+            for s in range(last_slot + 1, slot + 1):
+                buckets[s % RATE_LIMIT_WINDOW] = 0
+        entry[1] = slot
+    if sum(buckets) >= RATE_LIMIT_REQUESTS:
+        return False
+    buckets[slot % RATE_LIMIT_WINDOW] += 1
+    return True
+
+async def sweep_rate_limits(app):
+    """ Периодически убираем IP с истекшими окнами, чтобы словарь не рос бесконечно """
+    while True:
+        await asyncio.sleep(RATE_LIMIT_WINDOW)
+        slot = int(time.monotonic())
+        stale = [ip for ip, entry in rate_limit_store.items()
+                 if slot - entry[1] >= RATE_LIMIT_WINDOW]
+        for ip in stale:
+            del rate_limit_store[ip]
+
+async def init_app(app):
+    """ Создание общей ClientSession для Telegram с keep-alive соединениями """
+    app['tg_session'] = aiohttp.ClientSession(
+        timeout=_TG_TIMEOUT,
+        connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=75))
+    # Очередь исходящих сообщений: пакуем и шлем не чаще лимитов Telegram
+    app['tg_queue'] = asyncio.Queue(maxsize=1000)
+    app['tg_batcher'] = asyncio.create_task(telegram_batcher(app))
+    # Одно долгоживущее соединение с базой вместо открытия на каждый запрос
+    app['db'] = await aiosqlite.connect('notifications.db')
+    app['db'].row_factory = aiosqlite.Row
+    await app['db'].execute('PRAGMA journal_mode=WAL')
+    await app['db'].execute('PRAGMA synchronous=NORMAL')
+    await app['db'].execute('PRAGMA temp_store=MEMORY')
+    await app['db'].execute('PRAGMA mmap_size=268435456')
+    await app['db'].execute('PRAGMA wal_autocheckpoint=1000')
+    await create_table(app['db'])
+    # Очередь вставок: пишем в базу пачками в одной транзакции
+    app['insert_q'] = asyncio.Queue(maxsize=10000)
+    app['flusher'] = asyncio.create_task(flush_inserts(app))
+    app['rl_sweeper'] = asyncio.create_task(sweep_rate_limits(app))
+
+async def cleanup_app(app):
+    app['rl_sweeper'].cancel()
+    try:
+        await app['rl_sweeper']
+    except asyncio.CancelledError:
+        pass
+    # Останавливаем отправщик и досылаем накопившиеся сообщения
+    app['tg_batcher'].cancel()
+    try:
+        await app['tg_batcher']
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        # Упавший отправщик не должен срывать остальную остановку (сессия, база)
+        logger.error('Отправщик Telegram завершился с ошибкой: %s', e)
+    leftover_msgs = []
+    while not app['tg_queue'].empty():
+        leftover_msgs.append(app['tg_queue'].get_nowait())
+    if leftover_msgs:
+        try:
+            await send_to_telegram(app['tg_session'], '\n'.join(leftover_msgs))
+        except Exception as e:
+            logger.error('Не удалось дослать сообщения при остановке: %s', e)
+    await app['tg_session'].close()
+    app['flusher'].cancel()
+    try:
+        await app['flusher']
+    except asyncio.CancelledError:
+        pass
+    # Дописываем то, что осталось в очереди
+    leftovers = []
+    while not app['insert_q'].empty():
+        leftovers.append(app['insert_q'].get_nowait())
+    if leftovers:
+        await write_batch(app['db'], leftovers)
+    await app['db'].close()
+
+async def write_batch(db, batch):
+    await db.execute('BEGIN IMMEDIATE')
+    try:
+        await db.executemany(_INSERT_SQL, batch)
+        await db.commit()
+    except Exception:
+        # Откатываем, иначе соединение останется внутри открытой транзакции
+        # и все последующие пачки будут падать на BEGIN
+        await db.rollback()
+        raise
+
+async def flush_inserts(app):
+    """ Фоновая запись уведомлений: одна транзакция на пачку до 500 строк """
+    q = app['insert_q']
+    while True:
+        batch = [await q.get()]
+        while len(batch) < 500:
+            try:
+                batch.append(q.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        try:
+            await write_batch(app['db'], batch)
+        except Exception as e:
+            logger.error('Ошибка при записи в базу: %s', e)
+
+def queue_telegram(app, message):
+    """ Ставим сообщение в очередь отправки, не задерживая ответ хука """
+    try:
+        app['tg_queue'].put_nowait(message)
+    except asyncio.QueueFull:
+        logger.warning('Очередь Telegram переполнена, сообщение отброшено')
+
+async def telegram_batcher(app):
+    """ Склеивает до 10 сообщений (без дубликатов) в одну отправку, не чаще раза в секунду """
+    q = app['tg_queue']
+    while True:
+        batch = [await q.get()]
+        while len(batch) < 10:
+            try:
+                msg = q.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if msg not in batch:
+                batch.append(msg)
+        try:
+            await send_to_telegram(app['tg_session'], '\n'.join(batch))
+        except Exception as e:
+            # Сетевые сбои не должны убивать отправщик; пачка отбрасывается
+            logger.error('Ошибка при отправке пачки в Telegram: %s', e)
+        await asyncio.sleep(1)
+
+async def send_to_telegram(session, message):
     """ Отправка сообщения в Telegram """
-    url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
     params = {'chat_id': chat_id, 'text': message}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, data=params) as response:
-            if response.status == 200:
-                print('Сообщение успешно отправлено')
-            else:
-                print('Ошибка при отправке сообщения')
-
-async def get_db_connection():
-    conn = await aiosqlite.connect('notifications.db')  # Use aiosqlite for asynchronous SQLite connection
-    conn.row_factory = aiosqlite.Row
-    return conn
+    async with session.post(_TG_URL, data=params) as response:
+        if response.status == 200:
+            logger.debug('Сообщение успешно отправлено')
+        else:
+            logger.warning('Ошибка при отправке сообщения, статус %s', response.status)
 
-async def create_table():
-    conn = await get_db_connection()
-    await conn.execute('CREATE TABLE IF NOT EXISTS notifications (service TEXT, event TEXT, error BOOLEAN, message TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
-    await conn.commit()
-    await conn.close()
+async def create_table(db):
+    await db.execute('CREATE TABLE IF NOT EXISTS notifications (service TEXT, event TEXT, error BOOLEAN, message TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+    await db.commit()
 
 async def webhook(request):
     try:
         """ Endpoint для приема уведомлений от разных сервисов с аутентификацией. """
-        # Простая проверка API-ключа для безопасности
-        api_key = request.headers.get('API-Key')
-        if api_key != API_KEY:
-            await send_to_telegram('Попытка подключения к хуку с неверным API-ключом')
-            return web.json_response({"error": "Unauthorized"}, status=401)
-
-        data = await request.json()
-        if not data:
-            await send_to_telegram('Попытка подключения к хуку без данных')
-            return web.json_response({"error": "No data provided"}, status=400)
-
-        # Сохранение данных в базу данных
-        conn = await get_db_connection()
-        await conn.execute('INSERT INTO notifications (service, event, error, message, created_at) VALUES (?, ?, ?, ?, ?)',
-                        (data.get('service'), data.get('event'), data.get('error', False), data.get('message', ''), datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        await conn.commit()
-        await conn.close()
-        await send_to_telegram(f'- {data.get("service")}: {data.get("message")}')
-        return web.json_response({"success": True}, status=200)
+        # Ограничение частоты запросов по IP
+        if not check_rate_limit(client_ip(request)):
+            return json_response({"error": "Too Many Requests"}, status=429)
+
+        # Проверка API-ключа: сравнение за постоянное время по байтам
+        api_key = request.headers.get('API-Key', '').encode()
+        if not api_key or not secrets.compare_digest(api_key, _API_KEY_B):
+            queue_telegram(request.app, 'Попытка подключения к хуку с неверным API-ключом')
+            return json_response({"error": "Unauthorized"}, status=401)
+
+        body = await request.read()
+        if not body:
+            queue_telegram(request.app, 'Попытка подключения к хуку без данных')
+            return json_response({"error": "No data provided"}, status=400)
+
+        try:
+            notif = _NOTIF_DECODER.decode(body)
+        except msgspec.DecodeError as e:
+            return json_response({"error": str(e)}, status=400)
+
+        # Ставим строку в очередь, запись в базу выполнит фоновая задача
+        await request.app['insert_q'].put((notif.service, notif.event, notif.error, notif.message))
+        queue_telegram(request.app, f'- {notif.service}: {notif.message}')
+        # 204 No Content: уведомление принято в очередь, тело ответа не нужно
+        return web.Response(status=204)
     except Exception as e:
-        print(f"Произошла ошибка: {e}")
+        logger.error('Произошла ошибка: %s', e)
         # Вы можете добавить дополнительные действия при ошибке, например, отправку уведомления
-        return web.json_response({"error": "Internal Server Error"}, status=500)
+        return json_response({"error": "Internal Server Error"}, status=500)
 
 if __name__ == '__main__':
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(create_table())
+    # На горячем пути логируем только предупреждения; DEBUG включается при разборе проблем
+    logging.basicConfig(level=logging.WARNING)
+
+    try:
+        import uvloop
+        uvloop.install()  # libuv-цикл вместо стандартного selector-цикла
+    except ImportError:
+        pass
 
-    ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)  # Create an SSL context
-    ssl_context.load_cert_chain('/root/keys/cert.pem', '/root/keys/key_no_password.pem')  # Load your SSL certificate and private key
+    # За обратным прокси (Nginx/Envoy) TLS терминируется снаружи — задайте BEHIND_PROXY=1,
+    # чтобы не тратить цикл событий на рукопожатия. Прокси должен пробрасывать
+    # X-Forwarded-For/X-Real-IP, иначе лимитер увидит один IP на всех клиентов.
+    if BEHIND_PROXY:
+        ssl_context = None
+    else:
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain('/root/keys/cert.pem', '/root/keys/key_no_password.pem')  # Load your SSL certificate and private key
+        ssl_context.set_ciphers('ECDHE+AESGCM')
+        ssl_context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1 | ssl.OP_NO_COMPRESSION
 
+    app.on_startup.append(init_app)
+    app.on_cleanup.append(cleanup_app)
     app.router.add_post('/webhook', webhook)
-    web.run_app(app, ssl_context=ssl_context, port=5000, host='0.0.0.0')
-    
\ No newline at end of file
+    # reuse_port позволяет запустить несколько копий процесса на одном порту
+    # (например, под systemd/supervisord), ядро само распределит соединения.
+    # Запись в SQLite при этом сериализуется через WAL и BEGIN IMMEDIATE.
+    web.run_app(app, ssl_context=ssl_context, port=5000, host='0.0.0.0',
+                access_log=None, reuse_port=True)